@@ -1,12 +1,13 @@
-import pymysql
-import pandas as pd
+import connectorx as cx
+import pyarrow as pa
+import pyarrow.parquet as pq
 from google.cloud import bigquery
-import json
+import io
+import orjson
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import os
-import tempfile
-from sqlalchemy import create_engine, text
+import uuid
 from urllib.parse import quote_plus
 
 # Set up logging
@@ -16,13 +17,19 @@ logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format='%(asctime)s -
 
 # Load MySQL credentials from JSON file
 CREDENTIALS_PATH = "/backup/scripts/etl_mysql_to_bigquery/configs/db_credentials.json"
-with open(CREDENTIALS_PATH, "r") as f:
-    mysql_config = json.load(f)
+with open(CREDENTIALS_PATH, "rb") as f:
+    mysql_config = orjson.loads(f.read())
 
 # Load table schemas from JSON file
 SCHEMA_PATH = "/backup/scripts/etl_mysql_to_bigquery/configs/MYSQL_to_BigQuery_tables.json"
-with open(SCHEMA_PATH, "r") as f:
-    schema_config = json.load(f)
+with open(SCHEMA_PATH, "rb") as f:
+    schema_config = orjson.loads(f.read())
+
+# BigQuery schemas built once from the config, keyed by table name
+SCHEMAS = {
+    name: [bigquery.SchemaField(field["name"], field["type"]) for field in fields]
+    for name, fields in schema_config.items()
+}
 
 # Google BigQuery configuration
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = mysql_config["GOOGLE_APPLICATION_CREDENTIALS"]
@@ -31,121 +38,176 @@ project_id = mysql_config["BQ_PROJECT_ID"]
 dataset_id = mysql_config["BQ_DATASET_ID"]
 table_name = 'daily_log'
 
-def create_engine_url():
-    """Create SQLAlchemy engine URL safely."""
+# Number of ID ranges connectorx extracts in parallel
+PARTITION_NUM = 8
+
+# MySQL columns aliased to their BigQuery schema names in the SELECT
+COLUMN_ALIASES = {
+    'id': 'ID',
+    'backup_date': 'BackupDate',
+    'server': 'Server',
+    'database': 'Database',
+    'size': 'Size',
+    'state': 'State',
+    'last_update': 'LastUpdate',
+    'fileName': 'FileName'
+}
+
+def build_select_list():
+    """Build the explicit SELECT column list for daily_log from its BigQuery schema."""
+    mysql_columns = {alias: column for column, alias in COLUMN_ALIASES.items()}
+    select_columns = []
+    for field in schema_config[table_name]:
+        name = field["name"]
+        column = mysql_columns.get(name, name)
+        select_columns.append(f"`{column}` AS `{name}`" if column != name else f"`{name}`")
+    return ", ".join(select_columns)
+
+# SELECT column list built once from the schema config, in BigQuery column order
+SELECT_LIST = build_select_list()
+
+# Staging tables expire on their own if a run dies before it can drop them
+STAGING_EXPIRATION = timedelta(days=1)
+
+# Parquet codec for the upload; low-level zstd keeps most of the ratio at little CPU cost
+PARQUET_COMPRESSION = 'zstd'
+PARQUET_COMPRESSION_LEVEL = 1
+
+# Arrow types used to build the Parquet payload for each BigQuery column type, legacy names included
+ARROW_TYPES = {
+    'INT64': pa.int64(),
+    'INTEGER': pa.int64(),
+    'FLOAT64': pa.float64(),
+    'FLOAT': pa.float64(),
+    'NUMERIC': pa.decimal128(38, 9),
+    'DECIMAL': pa.decimal128(38, 9),
+    'BIGNUMERIC': pa.decimal256(76, 38),
+    'BIGDECIMAL': pa.decimal256(76, 38),
+    'BOOL': pa.bool_(),
+    'BOOLEAN': pa.bool_(),
+    'STRING': pa.string(),
+    'BYTES': pa.binary(),
+    'DATE': pa.date32(),
+    'TIME': pa.time64('us'),
+    'DATETIME': pa.timestamp('us'),
+    'TIMESTAMP': pa.timestamp('us', tz='UTC')
+}
+
+def get_arrow_type(table_name, column, bq_type):
+    """Get the Arrow type for a BigQuery column type from the schema config."""
+    arrow_type = ARROW_TYPES.get(bq_type.upper())
+    if arrow_type is None:
+        raise ValueError(f"Unsupported BigQuery type {bq_type} for column {column} of table {table_name}")
+    return arrow_type
+
+# Arrow schema of the extracted table, in SELECT column order
+ARROW_SCHEMA = pa.schema([
+    pa.field(field["name"], get_arrow_type(table_name, field["name"], field["type"]))
+    for field in schema_config[table_name]
+])
+
+def create_connection_url():
+    """Create MySQL connection URL safely."""
     password = quote_plus(mysql_config['DB_PWD'])
-    return create_engine(
-        f"mysql+pymysql://{mysql_config['DB_USR']}:{password}@{mysql_config['DB_HOST']}:{mysql_config['DB_PORT']}/{mysql_config['DB_NAME']}"
-    )
+    return f"mysql://{mysql_config['DB_USR']}:{password}@{mysql_config['DB_HOST']}:{mysql_config['DB_PORT']}/{mysql_config['DB_NAME']}"
 
 def extract_from_mysql():
     """Extract historical data from MySQL table daily_log where backup_date is less than 2025-03-07."""
-    engine = None
     try:
-        engine = create_engine_url()
-
         # Filter data where backup_date is less than 2025-03-07
-        query = "SELECT * FROM daily_log WHERE DATE(backup_date) < '2025-03-07'"
-
-        df = pd.read_sql(query, engine)
-
-        # Convert datetime columns to string format
-        for col in df.select_dtypes(include=['datetime64[ns]']).columns:
-            df[col] = df[col].dt.strftime('%Y-%m-%d %H:%M:%S')
-
-        logging.info(f"Successfully extracted {len(df)} rows from MySQL table: daily_log")
-
-        return df
+        query = f"SELECT {SELECT_LIST} FROM daily_log WHERE backup_date < '2025-03-07'"
+
+        # connectorx splits the query into ID ranges, runs them in parallel and decodes straight into Arrow
+        arrow_table = cx.read_sql(
+            create_connection_url(),
+            query,
+            return_type='arrow',
+            partition_on='ID',
+            partition_num=PARTITION_NUM
+        )
+        arrow_table = arrow_table.cast(ARROW_SCHEMA)
+        logging.info(f"Successfully extracted {arrow_table.num_rows} rows from MySQL table: daily_log")
+
+        return arrow_table
     except Exception as e:
         logging.error(f"Error extracting data from MySQL table daily_log: {e}")
         raise
-    finally:
-        if engine:
-            engine.dispose()
 
-def transform_data(df):
-    """Transform the data according to table requirements."""
+def load_to_bigquery(arrow_table):
+    """Load data into a staging table, then publish it over daily_log in one copy job."""
+    staging_ref = None
     try:
-        df = df.rename(columns={
-            'backup_date': 'BackupDate',
-            'server': 'Server',
-            'database': 'Database',
-            'size': 'Size',
-            'state': 'State',
-            'last_update': 'LastUpdate',
-            'fileName': 'FileName'
-        })
-
-        logging.info("Transformed data for table: daily_log")
-        return df
-    except Exception as e:
-        logging.error(f"Error transforming data for table daily_log: {e}")
-        raise
-
-def get_schema_from_config():
-    """Get BigQuery schema from JSON file."""
-    if table_name not in schema_config:
-        raise ValueError(f"No schema defined for table: {table_name}")
-
-    schema = [
-        bigquery.SchemaField(field["name"], field["type"])
-        for field in schema_config[table_name]
-    ]
-
-    return schema
-
-def load_to_bigquery(df):
-    """Load data into BigQuery."""
-    try:
-        if df.empty:
+        if arrow_table.num_rows == 0:
             logging.info("No new data to load for table: daily_log")
             return
 
         table_ref = f"{project_id}.{dataset_id}.{table_name}"
 
+        # Unique per run so concurrent runs on the same day never share or delete each other's staging data
+        run_id = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        staging_ref = f"{project_id}.{dataset_id}.{table_name}__staging_{run_id}"
+
+        staging_table = bigquery.Table(staging_ref, schema=SCHEMAS[table_name])
+        staging_table.expires = datetime.now(timezone.utc) + STAGING_EXPIRATION
+        bq_client.create_table(staging_table)
+
         job_config = bigquery.LoadJobConfig()
-        job_config.schema = get_schema_from_config()
-        job_config.source_format = bigquery.SourceFormat.NEWLINE_DELIMITED_JSON
-        job_config.write_disposition = bigquery.WriteDisposition.WRITE_TRUNCATE  # Truncate the table before loading
-
-        # Create a temporary file with a custom name
-        temp_file_name = f"mysql_to_bq_historical_{CURRENT_DATE}_{table_name}.json"
-        temp_file_path = os.path.join(tempfile.gettempdir(), temp_file_name)
-
-        with open(temp_file_path, 'w') as temp_file:
-            # Write DataFrame to the temporary file as newline-delimited JSON
-            df.to_json(temp_file.name, orient='records', lines=True)
-            logging.info(f"Temporary JSON file created: {temp_file_path}")
-            
-            # Load data to BigQuery
-            with open(temp_file_path, 'rb') as json_file:
-                job = bq_client.load_table_from_file(
-                    json_file,
-                    table_ref,
-                    job_config=job_config
-                )
-                job.result()  # Wait for the job to complete
-                logging.info(f"Data loaded from temporary file to BigQuery table: daily_log")
-
-        # Remove the temporary file
-        os.remove(temp_file_path)
-        logging.info(f"Temporary file deleted: {temp_file_path}")
+        job_config.schema = SCHEMAS[table_name]
+        job_config.source_format = bigquery.SourceFormat.PARQUET
+        job_config.write_disposition = bigquery.WriteDisposition.WRITE_EMPTY  # The staging table was just created empty
+
+        # Serialize the Arrow table to an in-memory compressed Parquet buffer
+        parquet_buffer = io.BytesIO()
+        pq.write_table(
+            arrow_table,
+            parquet_buffer,
+            compression=PARQUET_COMPRESSION,
+            compression_level=PARQUET_COMPRESSION_LEVEL
+        )
+        parquet_buffer.seek(0)
+
+        # Load data to the staging table so daily_log is never left empty mid-load
+        job = bq_client.load_table_from_file(
+            parquet_buffer,
+            staging_ref,
+            job_config=job_config,
+            rewind=True
+        )
+        job.result()  # Wait for the job to complete
+        logging.info(f"Data loaded from in-memory Parquet buffer to BigQuery staging table: {staging_ref}")
+
+        if job.output_rows != arrow_table.num_rows:
+            raise ValueError(
+                f"Staging table {staging_ref} has {job.output_rows} rows, expected {arrow_table.num_rows}"
+            )
+
+        # Atomically replace daily_log with the validated staging data
+        copy_config = bigquery.CopyJobConfig()
+        copy_config.write_disposition = bigquery.WriteDisposition.WRITE_TRUNCATE
+        bq_client.copy_table(staging_ref, table_ref, job_config=copy_config).result()
 
         table = bq_client.get_table(table_ref)
-        logging.info(f"Successfully loaded {len(df)} rows into BigQuery table: daily_log")
+        logging.info(f"Successfully loaded {arrow_table.num_rows} rows into BigQuery table: daily_log")
         logging.info(f"Total rows in table after load: {table.num_rows}")
 
     except Exception as e:
         logging.error(f"Error loading data into BigQuery table daily_log: {e}")
         raise
+    finally:
+        if staging_ref:
+            # Cleanup failures are only logged so they never mask the load or copy error
+            try:
+                bq_client.delete_table(staging_ref, not_found_ok=True)
+                logging.info(f"Staging table deleted: {staging_ref}")
+            except Exception as e:
+                logging.error(f"Error deleting staging table {staging_ref}: {e}")
 
 def run_etl():
     """Main ETL process."""
     try:
-        df = extract_from_mysql()
-        if not df.empty:
-            df = transform_data(df)
-            load_to_bigquery(df)
+        arrow_table = extract_from_mysql()
+        if arrow_table.num_rows > 0:
+            load_to_bigquery(arrow_table)
         else:
             logging.warning("No data extracted for table: daily_log")
     except Exception as e:
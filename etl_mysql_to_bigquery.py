@@ -1,15 +1,25 @@
 import pymysql
-import pandas as pd
+import pymysql.converters
+import pymysql.cursors
+from pymysql.constants import FIELD_TYPE
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import google.auth
+import requests
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import bigquery
-import json
+import hashlib
+import io
+import orjson
 import logging
 from datetime import datetime, timedelta
 import os
-import glob
 import argparse
-from sqlalchemy import create_engine, text
+import atexit
+from sqlalchemy import bindparam, create_engine, text
 from urllib.parse import quote_plus
-import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 # Set up logging
 CURRENT_DATE = datetime.now().strftime("%Y-%m-%d")
@@ -18,149 +28,277 @@ logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format='%(asctime)s -
 
 # Define the dumps directory
 DUMPS_DIR = "/backup/scripts/etl_mysql_to_bigquery/dumps"
+DUMP_SUFFIXES = (".json", ".json.gz")
 os.makedirs(DUMPS_DIR, exist_ok=True)
 
 # Load MySQL credentials from JSON file
 CREDENTIALS_PATH = "/backup/scripts/etl_mysql_to_bigquery/configs/db_credentials.json"
-with open(CREDENTIALS_PATH, "r") as f:
-    mysql_config = json.load(f)
+with open(CREDENTIALS_PATH, "rb") as f:
+    mysql_config = orjson.loads(f.read())
 
 # Load table schemas from JSON file
 SCHEMA_PATH = "/backup/scripts/etl_mysql_to_bigquery/configs/MYSQL_to_BigQuery_tables.json"
-with open(SCHEMA_PATH, "r") as f:
-    schema_config = json.load(f)
+with open(SCHEMA_PATH, "rb") as f:
+    schema_config = orjson.loads(f.read())
+
+# BigQuery schemas built once from the config, keyed by table name
+SCHEMAS = {
+    name: [bigquery.SchemaField(field["name"], field["type"]) for field in fields]
+    for name, fields in schema_config.items()
+}
+
+# Maximum number of tables processed concurrently
+MAX_WORKERS = 8
 
 # Google BigQuery configuration
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = mysql_config["GOOGLE_APPLICATION_CREDENTIALS"]
-bq_client = bigquery.Client()
 project_id = mysql_config["BQ_PROJECT_ID"]
 dataset_id = mysql_config["BQ_DATASET_ID"]
 
+# One authorized keep-alive session, pooled for the worker threads, shared by every BigQuery call
+bq_credentials, bq_project = google.auth.default(scopes=bigquery.Client.SCOPE)
+bq_session = AuthorizedSession(bq_credentials)
+bq_adapter = requests.adapters.HTTPAdapter(pool_connections=MAX_WORKERS * 2, pool_maxsize=MAX_WORKERS * 2)
+bq_session.mount("https://", bq_adapter)
+bq_client = bigquery.Client(project=bq_project, credentials=bq_credentials, _http=bq_session)
+
+# Number of rows pulled from the server-side cursor per round trip
+FETCH_SIZE = 50000
+
+# MySQL columns aliased to their BigQuery schema names in the SELECT
+COLUMN_ALIASES = {
+    'daily_log': {
+        'id': 'ID',
+        'backup_date': 'BackupDate',
+        'server': 'Server',
+        'database': 'Database',
+        'size': 'Size',
+        'state': 'State',
+        'last_update': 'LastUpdate',
+        'fileName': 'FileName'
+    }
+}
+
+# Batches smaller than this are streamed with insert_rows_json instead of a load job
+STREAMING_INSERT_THRESHOLD = 10000
+
+# Rows sent per insert_rows_json request
+STREAMING_INSERT_BATCH_SIZE = 500
+
+# Parquet codec for the upload; low-level zstd keeps most of the ratio at little CPU cost
+PARQUET_COMPRESSION = 'zstd'
+PARQUET_COMPRESSION_LEVEL = 1
+
+# Arrow types used to build the Parquet payload for each BigQuery column type, legacy names included
+ARROW_TYPES = {
+    'INT64': pa.int64(),
+    'INTEGER': pa.int64(),
+    'FLOAT64': pa.float64(),
+    'FLOAT': pa.float64(),
+    'NUMERIC': pa.decimal128(38, 9),
+    'DECIMAL': pa.decimal128(38, 9),
+    'BIGNUMERIC': pa.decimal256(76, 38),
+    'BIGDECIMAL': pa.decimal256(76, 38),
+    'BOOL': pa.bool_(),
+    'BOOLEAN': pa.bool_(),
+    'STRING': pa.string(),
+    'BYTES': pa.binary(),
+    'DATE': pa.date32(),
+    'TIME': pa.time64('us'),
+    'DATETIME': pa.timestamp('us'),
+    'TIMESTAMP': pa.timestamp('us', tz='UTC')
+}
+
+# Leave DATETIME/TIMESTAMP/DATE values as the text MySQL sends so Arrow can parse whole columns at once
+MYSQL_CONVERSIONS = {
+    field_type: converter
+    for field_type, converter in pymysql.converters.conversions.items()
+    if field_type not in (FIELD_TYPE.DATETIME, FIELD_TYPE.TIMESTAMP, FIELD_TYPE.DATE, FIELD_TYPE.NEWDATE)
+}
+
 def create_engine_url():
     """Create SQLAlchemy engine URL safely."""
     password = quote_plus(mysql_config['DB_PWD'])
     return create_engine(
-        f"mysql+pymysql://{mysql_config['DB_USR']}:{password}@{mysql_config['DB_HOST']}:{mysql_config['DB_PORT']}/{mysql_config['DB_NAME']}"
+        f"mysql+pymysql://{mysql_config['DB_USR']}:{password}@{mysql_config['DB_HOST']}:{mysql_config['DB_PORT']}/{mysql_config['DB_NAME']}",
+        connect_args={'conv': MYSQL_CONVERSIONS}
     )
 
+# Shared engine so every table in the run reuses pooled MySQL connections
+ENGINE = create_engine_url()
+atexit.register(ENGINE.dispose)
+
 def cleanup_old_files():
-    """Delete JSON files older than 7 days from the dumps directory."""
+    """Delete JSON dump files (plain or gzipped) older than 7 days from the dumps directory."""
     try:
-        current_time = datetime.now()
-        json_files = glob.glob(os.path.join(DUMPS_DIR, "*.json"))
-
-        for file_path in json_files:
-            file_modified_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-            if (current_time - file_modified_time) > timedelta(days=7):
-                os.remove(file_path)
-                logging.info(f"Deleted old file: {file_path}")
+        cutoff = (datetime.now() - timedelta(days=7)).timestamp()
+
+        # One directory scan; is_file() reuses the entry type from the scan, and only matching files are stat()ed
+        with os.scandir(DUMPS_DIR) as entries:
+            for entry in entries:
+                if entry.name.endswith(DUMP_SUFFIXES) and entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    logging.info(f"Deleted old file: {entry.path}")
     except Exception as e:
         logging.error(f"Error during cleanup of old files: {e}")
 
-def extract_from_mysql(table_name, date_column):
-    """Extract data from MySQL table for the current day."""
-    engine = None
-    try:
-        engine = create_engine_url()
-
-        # Filter data based on the current date
-        today = datetime.now().strftime('%Y-%m-%d')
-        query = f"SELECT * FROM {table_name} WHERE DATE({date_column}) = '{today}'"
-
-        df = pd.read_sql(query, engine)
-
-        # Convert datetime columns to string format
-        for col in df.select_dtypes(include=['datetime64[ns]']).columns:
-            df[col] = df[col].dt.strftime('%Y-%m-%d %H:%M:%S')
-
-        logging.info(f"Successfully extracted {len(df)} rows from MySQL table: {table_name}")
+def build_select_list(table_name):
+    """Build the explicit SELECT column list for a table from its BigQuery schema."""
+    mysql_columns = {alias: column for column, alias in COLUMN_ALIASES.get(table_name, {}).items()}
+    select_columns = []
+    for field in schema_config[table_name]:
+        name = field["name"]
+        column = mysql_columns.get(name, name)
+        select_columns.append(f"`{column}` AS `{name}`" if column != name else f"`{name}`")
+    return ", ".join(select_columns)
+
+# SELECT column lists built once from the schema config, keyed by table name
+SELECT_LISTS = {name: build_select_list(name) for name in schema_config}
+
+def get_arrow_type(table_name, column, bq_type):
+    """Get the Arrow type for a BigQuery column type from the schema config."""
+    arrow_type = ARROW_TYPES.get(bq_type.upper())
+    if arrow_type is None:
+        raise ValueError(f"Unsupported BigQuery type {bq_type} for column {column} of table {table_name}")
+    return arrow_type
+
+def build_arrow_schema(description, table_name):
+    """Build the Arrow schema for the selected columns from the BigQuery schema config."""
+    if table_name not in schema_config:
+        raise ValueError(f"No schema defined for table: {table_name}")
 
-        return df
-    except Exception as e:
-        logging.error(f"Error extracting data from MySQL table {table_name}: {e}")
-        raise
-    finally:
-        if engine:
-            engine.dispose()
+    field_types = {field["name"]: field["type"] for field in schema_config[table_name]}
+    fields = []
+    for column in description:
+        name = column[0]
+        if name not in field_types:
+            raise ValueError(f"Column {name} of table {table_name} is not in the schema config")
+        fields.append(pa.field(name, get_arrow_type(table_name, name, field_types[name])))
+    return pa.schema(fields)
+
+def build_column(values, arrow_type):
+    """Build a typed Arrow array for one column of a fetched chunk."""
+    if pa.types.is_boolean(arrow_type):
+        # MySQL flags arrive as integers of any width; Arrow casts nonzero values to true
+        return pa.array(values, type=pa.int64()).cast(arrow_type)
+    if pa.types.is_timestamp(arrow_type):
+        # Date and time values arrive as naive text; parse them in Arrow and interpret them as UTC, as before.
+        # Inferring first keeps any value pymysql still decoded (e.g. a datetime.date) castable too.
+        return pa.array(values).cast(pa.timestamp(arrow_type.unit)).cast(arrow_type)
+    if pa.types.is_time(arrow_type):
+        # MySQL TIME arrives as a timedelta; Arrow only casts to time-of-day through integer microseconds
+        return pa.array(values, type=pa.duration(arrow_type.unit)).cast(pa.int64()).cast(arrow_type)
+    # Let Arrow infer the MySQL value type, then cast, so e.g. numeric values in a STRING column are coerced
+    return pa.array(values).cast(arrow_type)
+
+def build_record_batch(rows, arrow_schema):
+    """Transpose a chunk of row tuples into an Arrow record batch."""
+    arrays = [
+        build_column(values, field.type)
+        for values, field in zip(zip(*rows), arrow_schema)
+    ]
+    return pa.RecordBatch.from_arrays(arrays, schema=arrow_schema)
 
-def transform_data(df, table_name):
-    """Transform the data according to table requirements."""
+def extract_from_mysql(table_name, date_column):
+    """Extract data from MySQL table for the current day into an Arrow table."""
     try:
-        if table_name == 'database_list':
-            bool_columns = ['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat',
-                            'encrypted', 'ssl', 'backup', 'load', 'size', 'active']
-            for col in bool_columns:
-                if col in df.columns:
-                    df[col] = df[col].astype(bool)
-
-        if table_name == 'daily_log':
-            df = df.rename(columns={
-                'backup_date': 'BackupDate',
-                'server': 'Server',
-                'database': 'Database',
-                'size': 'Size',
-                'state': 'State',
-                'last_update': 'LastUpdate',
-                'fileName': 'FileName'
-            })
-
-        logging.info(f"Transformed data for table: {table_name}")
-        return df
+        # Filter data based on the current date as a half-open range so an index on the column can be used
+        today = datetime.now().date()
+        tomorrow = today + timedelta(days=1)
+        query = f"SELECT {SELECT_LISTS[table_name]} FROM {table_name} WHERE {date_column} >= %s AND {date_column} < %s"
+
+        # Use a server-side cursor so rows are fetched in chunks instead of buffered client-side
+        connection = ENGINE.raw_connection()
+        try:
+            cursor = connection.cursor(pymysql.cursors.SSCursor)
+            try:
+                cursor.execute(query, (today, tomorrow))
+                arrow_schema = build_arrow_schema(cursor.description, table_name)
+
+                batches = []
+                while rows := cursor.fetchmany(FETCH_SIZE):
+                    batches.append(build_record_batch(rows, arrow_schema))
+            finally:
+                cursor.close()
+        finally:
+            connection.close()
+
+        arrow_table = pa.Table.from_batches(batches, schema=arrow_schema)
+        logging.info(f"Successfully extracted {arrow_table.num_rows} rows from MySQL table: {table_name}")
+
+        return arrow_table
     except Exception as e:
-        logging.error(f"Error transforming data for table {table_name}: {e}")
+        logging.error(f"Error extracting data from MySQL table {table_name}: {e}")
         raise
 
-def get_schema_from_config(table_name):
-    """Get BigQuery schema from JSON file."""
-    if table_name not in schema_config:
-        raise ValueError(f"No schema defined for table: {table_name}")
-
-    schema = [
-        bigquery.SchemaField(field["name"], field["type"])
-        for field in schema_config[table_name]
+def to_json_rows(arrow_table):
+    """Convert an Arrow table to JSON-serializable rows for streaming inserts."""
+    columns = [
+        pc.cast(column, pa.string()) if pa.types.is_temporal(column.type) else column
+        for column in arrow_table.columns
     ]
-
-    return schema
-
-def load_to_bigquery(df, table_name):
+    return pa.Table.from_arrays(columns, names=arrow_table.column_names).to_pylist()
+
+def build_row_id(row, table_name):
+    """Build a deterministic insertId for a row so retried inserts can be deduplicated."""
+    digest = hashlib.sha256(orjson.dumps(row, option=orjson.OPT_SORT_KEYS)).hexdigest()
+    return f"{table_name}:{digest}"
+
+def stream_to_bigquery(arrow_table, table_ref, table_name):
+    """Insert a small batch of rows into BigQuery through the streaming API."""
+    rows = to_json_rows(arrow_table)
+    row_ids = [build_row_id(row, table_name) for row in rows]
+    for start in range(0, len(rows), STREAMING_INSERT_BATCH_SIZE):
+        end = start + STREAMING_INSERT_BATCH_SIZE
+        errors = bq_client.insert_rows_json(table_ref, rows[start:end], row_ids=row_ids[start:end])
+        if errors:
+            raise RuntimeError(
+                f"Streaming insert into {table_name} failed after {start} rows were committed: {errors}"
+            )
+
+    logging.info(f"Successfully streamed {len(rows)} rows into BigQuery table: {table_name}")
+
+def load_to_bigquery(arrow_table, table_name):
     """Load data into BigQuery."""
     try:
-        if df.empty:
+        if arrow_table.num_rows == 0:
             logging.info(f"No new data to load for table: {table_name}")
             return
 
         table_ref = f"{project_id}.{dataset_id}.{table_name}"
 
+        # Small daily batches skip the load job and its per-table job quota
+        if arrow_table.num_rows < STREAMING_INSERT_THRESHOLD:
+            stream_to_bigquery(arrow_table, table_ref, table_name)
+            return
+
         job_config = bigquery.LoadJobConfig()
-        job_config.schema = get_schema_from_config(table_name)
-        job_config.source_format = bigquery.SourceFormat.NEWLINE_DELIMITED_JSON
+        job_config.schema = SCHEMAS[table_name]
+        job_config.source_format = bigquery.SourceFormat.PARQUET
         job_config.write_disposition = bigquery.WriteDisposition.WRITE_APPEND
 
-        # Create a temporary file with a custom name
-        temp_file_name = f"mysql_to_bq_{CURRENT_DATE}_{table_name}.json"
-        temp_file_path = os.path.join(tempfile.gettempdir(), temp_file_name)
-
-        with open(temp_file_path, 'w') as temp_file:
-            # Write DataFrame to the temporary file as newline-delimited JSON
-            df.to_json(temp_file.name, orient='records', lines=True)
-            logging.info(f"Temporary JSON file created: {temp_file_path}")
-            
-            # Load data to BigQuery
-            with open(temp_file_path, 'rb') as json_file:
-                job = bq_client.load_table_from_file(
-                    json_file,
-                    table_ref,
-                    job_config=job_config
-                )
-                job.result()  # Wait for the job to complete
-                logging.info(f"Data loaded from temporary file to BigQuery table: {table_name}")
-
-        # Remove the temporary file
-        os.remove(temp_file_path)
-        logging.info(f"Temporary file deleted: {temp_file_path}")
+        # Serialize the Arrow table to an in-memory compressed Parquet buffer
+        parquet_buffer = io.BytesIO()
+        pq.write_table(
+            arrow_table,
+            parquet_buffer,
+            compression=PARQUET_COMPRESSION,
+            compression_level=PARQUET_COMPRESSION_LEVEL
+        )
+        parquet_buffer.seek(0)
+
+        # Load data to BigQuery
+        job = bq_client.load_table_from_file(
+            parquet_buffer,
+            table_ref,
+            job_config=job_config,
+            rewind=True
+        )
+        job.result()  # Wait for the job to complete
+        logging.info(f"Data loaded from in-memory Parquet buffer to BigQuery table: {table_name}")
 
         table = bq_client.get_table(table_ref)
-        logging.info(f"Successfully loaded {len(df)} rows into BigQuery table: {table_name}")
+        logging.info(f"Successfully loaded {arrow_table.num_rows} rows into BigQuery table: {table_name}")
         logging.info(f"Total rows in table after load: {table.num_rows}")
 
     except Exception as e:
@@ -168,18 +306,28 @@ def load_to_bigquery(df, table_name):
         raise
 
 def get_mysql_tables():
-    """Get list of MySQL tables."""
-    allowed_tables = schema_config.keys()
-    engine = None
-    try:
-        engine = create_engine_url()
-        with engine.connect() as connection:
-            result = connection.execute(text("SHOW FULL TABLES WHERE Table_type = 'BASE TABLE'"))
-            tables = [row[0] for row in result if row[0] in allowed_tables]
-            return tables
-    finally:
-        if engine:
-            engine.dispose()
+    """Get list of MySQL tables that have a BigQuery schema."""
+    # Filter to the configured tables on the server rather than fetching every table name
+    query = text(
+        f"SHOW FULL TABLES WHERE Table_type = 'BASE TABLE' AND `Tables_in_{mysql_config['DB_NAME']}` IN :allowed_tables"
+    ).bindparams(bindparam('allowed_tables', expanding=True))
+    with ENGINE.connect() as connection:
+        result = connection.execute(query, {'allowed_tables': list(schema_config.keys())})
+        tables = [row[0] for row in result]
+        return tables
+
+def process_table(table_name):
+    """Run extract and load for a single table."""
+    logging.info(f"Processing table: {table_name}")
+
+    # Determine the date column to filter by
+    date_column = 'creation_date' if table_name == 'database_list' else 'backup_date'
+
+    arrow_table = extract_from_mysql(table_name, date_column)
+    if arrow_table.num_rows > 0:
+        load_to_bigquery(arrow_table, table_name)
+    else:
+        logging.warning(f"No data extracted for table: {table_name}")
 
 def run_etl():
     """Main ETL process."""
@@ -187,18 +335,10 @@ def run_etl():
         tables = get_mysql_tables()
         logging.info(f"Found tables in MySQL: {tables}")
 
-        for table_name in tables:
-            logging.info(f"Processing table: {table_name}")
-
-            # Determine the date column to filter by
-            date_column = 'creation_date' if table_name == 'database_list' else 'backup_date'
-
-            df = extract_from_mysql(table_name, date_column)
-            if not df.empty:
-                df = transform_data(df, table_name)
-                load_to_bigquery(df, table_name)
-            else:
-                logging.warning(f"No data extracted for table: {table_name}")
+        # Tables are independent, so overlap their MySQL and BigQuery I/O
+        if tables:
+            with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(tables))) as executor:
+                list(executor.map(process_table, tables))
 
         cleanup_old_files()
 